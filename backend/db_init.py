@@ -1,33 +1,58 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
-db_init.py ― Gera a tabela `empresas_vec` com vetores de CNAE e cria um
-índice VSS (HNSW) no DuckDB.
+db_init.py ― Cria o índice FTS (BM25) de `empresas` no DuckDB.
+
+Execução idempotente: o índice FTS só é (re)criado quando ainda não
+existe, ou quando `--force` é informado.
+
+    python backend/db_init.py [--force]
 
 Pré-requisitos:
-    pip install duckdb pandas numpy
-    • O arquivo ./cnpj.duckdb deve existir e conter a tabela `estabelecimentos`.
-    • DuckDB ≥ 0.10.0 com as extensões vss e fts instaladas.
+    pip install duckdb
+    • O arquivo ./cnpj.duckdb deve existir e conter a tabela `empresas`.
+    • DuckDB ≥ 0.10.0 com a extensão fts instalada.
 """
 
+import argparse
+
 import duckdb
-import numpy as np
-import pandas as pd
 
 # ── Configurações básicas ───────────────────────────────────────────────
 DB_PATH        = "./cnpj.duckdb"
-TABLE_NAME     = "empresas_vec"
-INDEX_NAME     = "idx_emp_cnae_vec"
-METRIC         = "cosine"
-SEC_WEIGHT     = 0.30          # peso atribuído às CNAEs secundárias
-
-# ── Conexão e extensões ─────────────────────────────────────────────────
-con = duckdb.connect(DB_PATH)
-con.execute("LOAD vss;")   # Vetor-Similarity Search
-con.execute("LOAD fts;")   # (caso você queira FTS depois)
-con.execute("PRAGMA hnsw_enable_experimental_persistence = true;")
-
-con.execute("""
-    PRAGMA create_fts_index('empresas','cnpj_basico','razao_social', stemmer = 'portuguese',overwrite =1,lower=0);
-""")
-con.close()
+FTS_SCHEMA     = "fts_main_empresas"
+
+
+# ── Verificações de existência ──────────────────────────────────────────
+def _fts_exists(con: duckdb.DuckDBPyConnection) -> bool:
+    return con.execute(
+        "SELECT count(*) FROM duckdb_schemas() WHERE schema_name = ?", [FTS_SCHEMA]
+    ).fetchone()[0] > 0
+
+
+# ── Índice FTS (BM25) sobre razao_social ────────────────────────────────
+def build_fts(con: duckdb.DuckDBPyConnection) -> None:
+    # strip_accents=1 é o padrão do fts: "SAO" e "SÃO" viram o mesmo termo
+    con.execute("""
+        PRAGMA create_fts_index('empresas','cnpj_basico','razao_social', stemmer = 'portuguese',overwrite =1,lower=1);
+    """)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cria o índice FTS do cnpj.duckdb.")
+    parser.add_argument("--force", action="store_true", help="recria o índice mesmo que já exista")
+    args = parser.parse_args()
+
+    # ── Conexão e extensões ─────────────────────────────────────────────
+    con = duckdb.connect(DB_PATH)
+    con.execute("LOAD fts;")   # BM25 sobre razao_social
+
+    if args.force or not _fts_exists(con):
+        build_fts(con)
+    else:
+        print(f"{FTS_SCHEMA} já existe — pulando (use --force para recriar).")
+    con.close()
+
+
+if __name__ == "__main__":
+    main()
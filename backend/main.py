@@ -8,61 +8,198 @@
 # ------------------------------------------------------------------------------
 from __future__ import annotations
 
+import asyncio
+import contextlib
+import functools
+import itertools
+import json
+import logging
 import os
+import queue
 import re
 import time
+import unicodedata
 import uuid
 import sqlite3
-from typing import List, Tuple, Dict, Any
+from typing import AsyncIterator, Iterable, Iterator, List, Tuple, Dict, Any
 
 import duckdb
 from dotenv import load_dotenv
 from fastapi import FastAPI, Header
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, TypeAdapter
 from pydantic_ai import Agent
 
 # ─── Configuração de bancos ----------------------------------------------------
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # DuckDB (empresas)
+# Somente leitura: os helpers usam cursores de um pool fixo (POOL_SIZE), que
+# compartilham catálogo e buffer cache mas executam de forma independente.
 DB_FILE = os.getenv("CNPJ_DB", "./cnpj.duckdb")
-con: duckdb.DuckDBPyConnection = duckdb.connect(DB_FILE)
-try:
-    con.execute("LOAD fts;")
-except duckdb.CatalogException:
-    pass
+DB_THREADS = int(os.getenv("CNPJ_THREADS", os.cpu_count() or 4))
+POOL_SIZE = int(os.getenv("CNPJ_POOL_SIZE", "4"))
 
 # SQLite (memória)
+# Leituras usam um pool de conexões (MEM_POOL_SIZE): uma conexão sqlite3 não
+# pode ser usada por duas threads ao mesmo tempo. Escritas têm conexão própria.
 MEM_FILE = os.getenv("MEM_DB", "./memory.sqlite")
-mem_con = sqlite3.connect(MEM_FILE, check_same_thread=False)
+MEM_POOL_SIZE = int(os.getenv("MEM_POOL_SIZE", "4"))
 
-# Migração automática: adiciona coluna user_name se faltar
-cols = [row[1] for row in mem_con.execute("PRAGMA table_info(chat_history);").fetchall()]
-if cols and "user_name" not in cols:
-    mem_con.execute("ALTER TABLE chat_history ADD COLUMN user_name TEXT;")
-    mem_con.commit()
+# As conexões são abertas no lifespan do FastAPI (ver `lifespan`) e ficam em
+# `app.state`: importar o módulo não toca em nenhum banco.
 
-# Cria tabelas de histórico e memória longa
-mem_con.execute(
-    """
-    CREATE TABLE IF NOT EXISTS chat_history (
-        session_id TEXT,
-        user_name  TEXT,
-        ts         REAL,
-        role       TEXT,
-        content    TEXT
+
+class CursorPool:
+    """Pool limitado de cursores DuckDB ou conexões SQLite; `acquire()` bloqueia
+    até haver um livre, e cada um é usado por uma só thread de cada vez."""
+
+    def __init__(self, conexoes: Iterable[Any]) -> None:
+        self._free: queue.Queue[Any] = queue.Queue()
+        for c in conexoes:
+            self._free.put(c)
+
+    @contextlib.contextmanager
+    def acquire(self) -> Iterator[Any]:
+        c = self._free.get()
+        try:
+            yield c
+        finally:
+            self._free.put(c)
+
+    def close(self) -> None:
+        while not self._free.empty():
+            self._free.get_nowait().close()
+
+
+def _abre_duckdb(path: str) -> duckdb.DuckDBPyConnection:
+    con = duckdb.connect(path, read_only=True, config={"threads": DB_THREADS})
+    try:
+        con.execute("LOAD fts;")
+    except duckdb.CatalogException:
+        pass
+
+    # Aquece o índice BM25 (dicionário, estatísticas e páginas) para que a
+    # primeira pergunta não pague a carga fria do FTS.
+    try:
+        con.execute(
+            "SELECT cnpj_basico FROM empresas "
+            "WHERE fts_main_empresas.match_bm25(cnpj_basico, 'warmup') IS NOT NULL LIMIT 1"
+        ).fetchone()
+    except duckdb.CatalogException:
+        pass
+    return con
+
+
+def _abre_conexao_memoria(path: str) -> sqlite3.Connection:
+    mem_con = sqlite3.connect(path, check_same_thread=False)
+
+    # WAL: leitores (histórico, FTS5) não bloqueiam o commit do turno; com
+    # synchronous=NORMAL só o checkpoint faz fsync.
+    for pragma in (
+        "journal_mode = WAL",
+        "synchronous = NORMAL",
+        "temp_store = MEMORY",
+        "cache_size = -65536",      # 64 MiB
+        "mmap_size = 268435456",    # 256 MiB
+    ):
+        mem_con.execute(f"PRAGMA {pragma};")
+    return mem_con
+
+
+def _migra_memoria(mem_con: sqlite3.Connection) -> None:
+    """Cria/migra o esquema da memória; roda uma vez por startup."""
+    # Migração automática: adiciona coluna user_name se faltar
+    cols = [row[1] for row in mem_con.execute("PRAGMA table_info(chat_history);").fetchall()]
+    if cols and "user_name" not in cols:
+        mem_con.execute("ALTER TABLE chat_history ADD COLUMN user_name TEXT;")
+        mem_con.commit()
+
+    # Cria tabelas de histórico e memória longa
+    mem_con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS chat_history (
+            session_id BLOB,       -- UUID em 16 bytes
+            user_name  TEXT,
+            ts         REAL,
+            role       TEXT,
+            content    TEXT
+        )
+        """
     )
-    """
-)
-mem_con.execute(
-    """
-    CREATE VIRTUAL TABLE IF NOT EXISTS long_term_memory USING fts5(
-        content,
-        metadata
+    # Índices para o histórico por sessão e por usuário (ORDER BY ts DESC LIMIT n)
+    mem_con.execute("CREATE INDEX IF NOT EXISTS ix_hist_sess_ts ON chat_history(session_id, ts DESC);")
+    mem_con.execute("CREATE INDEX IF NOT EXISTS ix_hist_user_ts ON chat_history(user_name, ts DESC);")
+    # Migração: session_id gravado como texto (UUID com hífens) vira BLOB de 16 bytes
+    legado = mem_con.execute(
+        "SELECT DISTINCT session_id FROM chat_history WHERE typeof(session_id) = 'text'"
+    ).fetchall()
+    if legado:
+        convertidos = []
+        for (sid,) in legado:
+            with contextlib.suppress(ValueError):
+                convertidos.append((uuid.UUID(sid).bytes, sid))
+        mem_con.executemany(
+            "UPDATE chat_history SET session_id = ? WHERE session_id = ?", convertidos
+        )
+        mem_con.execute("REINDEX ix_hist_sess_ts;")
+        mem_con.commit()
+    # Memória longa: os textos ficam em long_term_docs e o FTS5 é external
+    # content sobre ela (o índice não guarda cópia do conteúdo); triggers
+    # mantêm o índice em dia.
+    mem_con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS long_term_docs (
+            id       INTEGER PRIMARY KEY,
+            content  TEXT,
+            metadata TEXT
+        )
+        """
     )
-    """
-)
-mem_con.commit()
+    # Migração: versões anteriores guardavam o conteúdo dentro do próprio FTS5
+    ltm_sql = mem_con.execute(
+        "SELECT sql FROM sqlite_master WHERE name = 'long_term_memory'"
+    ).fetchone()
+    migra_ltm = bool(ltm_sql) and "content=" not in ltm_sql[0].replace(" ", "")
+    if migra_ltm:
+        mem_con.execute(
+            "INSERT INTO long_term_docs (content, metadata) "
+            "SELECT content, metadata FROM long_term_memory ORDER BY rowid"
+        )
+        mem_con.execute("DROP TABLE long_term_memory;")
+    mem_con.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS long_term_memory USING fts5(
+            content,
+            metadata,
+            content='long_term_docs',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """
+    )
+    ltm_del = (
+        "INSERT INTO long_term_memory (long_term_memory, rowid, content, metadata) "
+        "VALUES ('delete', old.id, old.content, old.metadata);"
+    )
+    ltm_ins = (
+        "INSERT INTO long_term_memory (rowid, content, metadata) "
+        "VALUES (new.id, new.content, new.metadata);"
+    )
+    for nome, evento, corpo in (
+        ("long_term_docs_ai", "INSERT", ltm_ins),
+        ("long_term_docs_ad", "DELETE", ltm_del),
+        ("long_term_docs_au", "UPDATE", ltm_del + " " + ltm_ins),
+    ):
+        mem_con.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {nome} AFTER {evento} ON long_term_docs "
+            f"BEGIN {corpo} END;"
+        )
+    if migra_ltm:
+        mem_con.execute("INSERT INTO long_term_memory (long_term_memory) VALUES ('rebuild');")
+    mem_con.commit()
 
 # ─── Pydantic Models -----------------------------------------------------------
 
@@ -131,234 +268,303 @@ class EmpresaEnderecoRow(BaseModel):
     endereco: str | None
 
 
+class DadosEmpresa(BaseModel):
+    endereco: EmpresaEnderecoRow | None = None
+    simples: list[SimplesRow] = []
+    socios: list[SocioRow] = []
+    natureza: NaturezaRow | None = None
+    cnaes: CnaeRow | None = None
+    contato: ContatoRow | None = None
+
+
+# Serialização em lote (pydantic-core) das listas devolvidas em /ask
+_SIMPLES_TA = TypeAdapter(list[SimplesRow])
+_SOCIOS_TA = TypeAdapter(list[SocioRow])
+
+
 # ─── DuckDB Helpers ------------------------------------------------------------
 
-def busca_empresa(nome: str) -> EmpresaRow:
-    try:
-        row = con.execute(
+@functools.lru_cache(maxsize=4096)
+def _cnpj_by_nome(nome: str) -> Tuple[str | None, str | None]:
+    """(cnpj_basico, razao_social) do melhor match BM25 para `nome` já normalizado.
+
+    O FTS já ignora acentos e caixa; o LIKE (varredura completa de `empresas`)
+    compara strip_accents(upper(razao_social)) e só roda quando o índice FTS
+    não existe. Um miss no BM25 retorna (None, None).
+    """
+    with app.state.pool.acquire() as c:
+        try:
+            row = c.execute(
+                """
+                WITH fts AS (
+                  SELECT cnpj_basico,
+                         razao_social,
+                         fts_main_empresas.match_bm25(cnpj_basico, ?, fields := 'razao_social', k := 0.5, b := 1.2, conjunctive := 1) AS score
+                  FROM empresas
+                )
+                SELECT cnpj_basico, razao_social
+                FROM fts
+                WHERE score IS NOT NULL
+                ORDER BY score DESC
+                LIMIT 1;
+                """,
+                [nome],
+            ).fetchone()
+            return (row[0], row[1]) if row else (None, None)
+        except duckdb.CatalogException:
+            pass
+
+        row = c.execute(
             """
             SELECT cnpj_basico, razao_social
-            FROM (
-              SELECT cnpj_basico,
-                     razao_social,
-                     fts_main_empresas.match_bm25(cnpj_basico, ?, fields := 'razao_social', k := 0.5, b := 1.2, conjunctive := 1) AS score
-              FROM empresas
-              WHERE score IS NOT NULL
-            )
-            ORDER BY score DESC
+            FROM empresas
+            WHERE strip_accents(upper(razao_social)) LIKE '%' || ? || '%'
             LIMIT 1;
             """,
             [nome],
         ).fetchone()
-        if row:
-            return EmpresaRow(cnpj=row[0], razao_social=row[1])
-    except duckdb.CatalogException:
-        pass
+    return (row[0], row[1]) if row else (None, None)
 
-    row = con.execute(
-        """
-        SELECT cnpj_basico, razao_social
-        FROM empresas
-        WHERE razao_social ILIKE '%' || ? || '%'
-        LIMIT 1;
-        """,
-        [nome],
-    ).fetchone()
-    return EmpresaRow(cnpj=row[0], razao_social=row[1]) if row else EmpresaRow(cnpj=None, razao_social=None)
 
-
-def busca_endereco(cnpj: str) -> EmpresaEnderecoRow:
-    row = con.execute(
-        """
-        SELECT
-            substr(cnpj_basico||cnpj_ordem||cnpj_dv, 1, 2) || '.' ||
-            substr(cnpj_basico||cnpj_ordem||cnpj_dv, 3, 3) || '.' ||
-            substr(cnpj_basico||cnpj_ordem||cnpj_dv, 6, 3) || '/' ||
-            substr(cnpj_basico||cnpj_ordem||cnpj_dv, 9, 4) || '-' ||
-            substr(cnpj_basico||cnpj_ordem||cnpj_dv,13, 2) AS cnpj_mascarado,
-            nome_fantasia,
-            'Endereço: ' || tipo_logradouro || ' ' || logradouro || ', ' || numero ||
-            ' Complemento: ' || complemento || ' Bairro: ' || bairro ||
-            ' Cidade: ' || M.descricao || ' Estado: ' || uf AS endereco
-        FROM estabelecimentos E
-        JOIN municipios M ON E.municipio = M.codigo
-        WHERE cnpj_basico = ?
-        LIMIT 1;
-        """,
-        [cnpj],
-    ).fetchone()
-    return (
-        EmpresaEnderecoRow(cnpj_mascarado=row[0], nome_fantasia=row[1], endereco=row[2])
-        if row
-        else EmpresaEnderecoRow(cnpj_mascarado=None, nome_fantasia=None, endereco=None)
+def _normaliza_nome(nome: str) -> str:
+    """Chave canônica do nome: sem acentos, maiúsculas e espaços colapsados."""
+    sem_acento = "".join(
+        ch for ch in unicodedata.normalize("NFKD", nome) if not unicodedata.combining(ch)
     )
+    return " ".join(sem_acento.upper().split())
 
 
-def busca_simples(cnpj: str) -> List[SimplesRow]:
-    rows = con.execute(
-        """
-        SELECT
-          cnpj_basico,
-          opcao_simples,
-          CAST(data_opcao_simples AS VARCHAR) AS data_opcao_simples,
-          CAST(data_exclusao_simples AS VARCHAR) AS data_exclusao_simples,
-          opcao_mei,
-          CAST(data_opcao_mei AS VARCHAR) AS data_opcao_mei,
-          CAST(data_exclusao_mei AS VARCHAR) AS data_exclusao_mei
-        FROM simples
-        WHERE cnpj_basico = ?
-        ORDER BY data_opcao_simples DESC
-        """,
-        [cnpj],
-    ).fetchall()
-    return [
-        SimplesRow(
-            cnpj_basico=r[0],
-            opcao_simples=r[1],
-            data_opcao_simples=r[2],
-            data_exclusao_simples=r[3],
-            opcao_mei=r[4],
-            data_opcao_mei=r[5],
-            data_exclusao_mei=r[6],
-        )
-        for r in rows
-    ]
+def busca_empresa(nome: str) -> EmpresaRow:
+    cnpj, razao_social = _cnpj_by_nome(_normaliza_nome(nome))
+    return EmpresaRow(cnpj=cnpj, razao_social=razao_social)
 
 
-def lista_socios(cnpj: str) -> List[SocioRow]:
-    rows = con.execute(
-        """
-        SELECT
-          identificador_socio,
-          nome_socio_razao_social,
-          cpf_cnpj_socio,
-          qualificacao_socio,
-          CAST(data_entrada_sociedade AS VARCHAR) AS data_entrada_sociedade,
-          pais,
-          nome_representante,
-          qualificacao_representante,
-          faixa_etaria
-        FROM socios
-        WHERE cnpj_basico = ?
-        ORDER BY data_entrada_sociedade DESC
-        """,
-        [cnpj],
-    ).fetchall()
-    return [
-        SocioRow(
-            identificador_socio=r[0],
-            nome_socio_razao_social=r[1],
-            cpf_cnpj_socio=r[2],
-            qualificacao_socio=r[3],
-            data_entrada_sociedade=r[4],
-            pais=r[5],
-            nome_representante=r[6],
-            qualificacao_representante=r[7],
-            faixa_etaria=r[8],
-        )
-        for r in rows
-    ]
+@functools.lru_cache(maxsize=4096)
+def busca_empresa_completa(cnpj: str) -> DadosEmpresa:
+    """Endereço, Simples, sócios, natureza jurídica, CNAEs e contato de um CNPJ básico."""
+    with app.state.pool.acquire() as c:
+        row = c.execute(
+            """
+            WITH est AS (
+              SELECT *
+              FROM estabelecimentos
+              WHERE cnpj_basico = $1
+              ORDER BY identificador_matriz_filial
+              LIMIT 1
+            )
+            SELECT
+              (
+                SELECT struct_pack(
+                  cnpj_mascarado :=
+                    substr(cnpj_basico||cnpj_ordem||cnpj_dv, 1, 2) || '.' ||
+                    substr(cnpj_basico||cnpj_ordem||cnpj_dv, 3, 3) || '.' ||
+                    substr(cnpj_basico||cnpj_ordem||cnpj_dv, 6, 3) || '/' ||
+                    substr(cnpj_basico||cnpj_ordem||cnpj_dv, 9, 4) || '-' ||
+                    substr(cnpj_basico||cnpj_ordem||cnpj_dv,13, 2),
+                  nome_fantasia := nome_fantasia,
+                  endereco :=
+                    'Endereço: ' || tipo_logradouro || ' ' || logradouro || ', ' || numero ||
+                    ' Complemento: ' || complemento || ' Bairro: ' || bairro ||
+                    ' Cidade: ' || M.descricao || ' Estado: ' || uf
+                )
+                FROM est E
+                JOIN municipios M ON E.municipio = M.codigo
+              ) AS endereco,
+              (
+                SELECT list(
+                  struct_pack(
+                    cnpj_basico := cnpj_basico,
+                    opcao_simples := opcao_simples,
+                    data_opcao_simples := CAST(data_opcao_simples AS VARCHAR),
+                    data_exclusao_simples := CAST(data_exclusao_simples AS VARCHAR),
+                    opcao_mei := opcao_mei,
+                    data_opcao_mei := CAST(data_opcao_mei AS VARCHAR),
+                    data_exclusao_mei := CAST(data_exclusao_mei AS VARCHAR)
+                  )
+                  ORDER BY data_opcao_simples DESC
+                )
+                FROM simples
+                WHERE cnpj_basico = $1
+              ) AS simples,
+              (
+                SELECT list(
+                  struct_pack(
+                    identificador_socio := identificador_socio,
+                    nome_socio_razao_social := nome_socio_razao_social,
+                    cpf_cnpj_socio := cpf_cnpj_socio,
+                    qualificacao_socio := qualificacao_socio,
+                    data_entrada_sociedade := CAST(data_entrada_sociedade AS VARCHAR),
+                    pais := pais,
+                    nome_representante := nome_representante,
+                    qualificacao_representante := qualificacao_representante,
+                    faixa_etaria := faixa_etaria
+                  )
+                  ORDER BY data_entrada_sociedade DESC
+                )
+                FROM socios
+                WHERE cnpj_basico = $1
+              ) AS socios,
+              (
+                SELECT struct_pack(codigo := e.natureza_juridica, descricao := n.descricao)
+                FROM empresas e
+                LEFT JOIN naturezas n ON e.natureza_juridica = n.codigo
+                WHERE e.cnpj_basico = $1
+                LIMIT 1
+              ) AS natureza,
+              (
+                SELECT struct_pack(
+                  cnae_principal := est.cnae_fiscal_principal,
+                  desc_principal := cp.descricao,
+                  cnae_secundario := est.cnae_fiscal_secundaria,
+                  desc_secundario := cs.descricao
+                )
+                FROM est
+                LEFT JOIN cnaes cp ON est.cnae_fiscal_principal = cp.codigo
+                LEFT JOIN cnaes cs ON est.cnae_fiscal_secundaria = cs.codigo
+              ) AS cnaes,
+              (
+                SELECT struct_pack(
+                  telefone := CASE WHEN ddd1 IS NOT NULL AND telefone1 IS NOT NULL THEN ddd1 || telefone1 ELSE NULL END,
+                  fax := CASE WHEN ddd_fax IS NOT NULL AND fax IS NOT NULL THEN ddd_fax || fax ELSE NULL END,
+                  email := email
+                )
+                FROM est
+              ) AS contato
+            """,
+            [cnpj],
+        ).fetchone()
+    endereco, simples, socios, natureza, cnaes, contato = row
+    return DadosEmpresa.model_validate(
+        {
+            "endereco": endereco,
+            "simples": simples or [],
+            "socios": socios or [],
+            "natureza": natureza,
+            "cnaes": cnaes,
+            "contato": contato,
+        }
+    )
 
 
-def busca_natureza(cnpj: str) -> NaturezaRow:
-    row = con.execute(
-        """
-        SELECT
-          e.natureza_juridica,
-          n.descricao
-        FROM empresas e
-        LEFT JOIN naturezas n ON e.natureza_juridica = n.codigo
-        WHERE e.cnpj_basico = ?
-        LIMIT 1
-        """,
-        [cnpj],
-    ).fetchone()
-    return NaturezaRow(codigo=row[0], descricao=row[1]) if row else NaturezaRow(codigo=None, descricao=None)
+# ─── Memória Utilitários -------------------------------------------------------
 
+# Escritas: os helpers só enfileiram (sql, params) em `app.state.write_q`; uma
+# única tarefa (`_writer_loop`) drena a fila em lotes e grava cada lote numa
+# transação, com executemany por instrução e um só commit.
+WRITE_BATCH_WINDOW = 0.02   # s de espera para acumular escritas antes do commit
+WRITE_RETRIES = 3           # tentativas por lote antes de gravar item a item
+WRITE_RETRY_DELAY = 0.1     # s antes da 1ª nova tentativa (dobra a cada falha)
+WRITER_SHUTDOWN_TIMEOUT = 5.0   # s para esvaziar a fila no shutdown
+
+_HIST_INSERT_SQL = "INSERT INTO chat_history VALUES (?,?,?,?,?)"
+_LTM_INSERT_SQL = "INSERT INTO long_term_docs (content, metadata) VALUES (?, ?)"
+
+
+def _grava_lote(mem_con: sqlite3.Connection, lote: List[Tuple[str, tuple]]) -> None:
+    with mem_con:
+        mem_con.execute("BEGIN IMMEDIATE")
+        # Agrupa instruções consecutivas iguais, preservando a ordem da fila
+        for sql, grupo in itertools.groupby(lote, key=lambda item: item[0]):
+            mem_con.executemany(sql, [params for _, params in grupo])
+
+
+async def _grava_com_retry(mem_con: sqlite3.Connection, lote: List[Tuple[str, tuple]]) -> None:
+    """Grava o lote com novas tentativas (ex.: `database is locked` com vários
+    workers); se ainda falhar, grava item a item para descartar só o que não entra."""
+    for tentativa in range(1, WRITE_RETRIES + 1):
+        try:
+            await asyncio.to_thread(_grava_lote, mem_con, lote)
+            return
+        except Exception:
+            logger.warning(
+                "Falha ao gravar lote de %d escrita(s) (tentativa %d/%d)",
+                len(lote), tentativa, WRITE_RETRIES, exc_info=True,
+            )
+            await asyncio.sleep(WRITE_RETRY_DELAY * 2 ** (tentativa - 1))
+
+    for item in lote:
+        try:
+            await asyncio.to_thread(_grava_lote, mem_con, [item])
+        except Exception:
+            logger.exception("Escrita descartada na memória: %s", item[0])
+
+
+async def _writer_loop(q: asyncio.Queue[Tuple[str, tuple]], mem_con: sqlite3.Connection) -> None:
+    while True:
+        lote = [await q.get()]
+        try:
+            await asyncio.sleep(WRITE_BATCH_WINDOW)
+            while not q.empty():
+                lote.append(q.get_nowait())
+            await _grava_com_retry(mem_con, lote)
+        except Exception:
+            # Nunca encerra o writer: a fila continuaria enchendo sem leitor
+            logger.exception("Erro inesperado no writer da memória")
+        finally:
+            for _ in lote:
+                q.task_done()
+
+
+async def _add_msg(session_id: bytes, user_name: str | None, role: str, content: str) -> None:
+    await app.state.write_q.put(
+        (_HIST_INSERT_SQL, (session_id, user_name, time.time(), role, content))
+    )
 
-def busca_cnaes(cnpj: str) -> CnaeRow:
-    row = con.execute(
-        """
-        SELECT
-          est.cnae_fiscal_principal,
-          cp.descricao AS desc_principal,
-          est.cnae_fiscal_secundaria,
-          cs.descricao AS desc_secundario
-        FROM estabelecimentos est
-        LEFT JOIN cnaes cp ON est.cnae_fiscal_principal = cp.codigo
-        LEFT JOIN cnaes cs ON est.cnae_fiscal_secundaria = cs.codigo
-        WHERE est.cnpj_basico = ?
-        LIMIT 1
-        """,
-        [cnpj],
-    ).fetchone()
-    if row:
-        return CnaeRow(
-            cnae_principal=row[0],
-            desc_principal=row[1],
-            cnae_secundario=row[2],
-            desc_secundario=row[3],
-        )
-    return CnaeRow(cnae_principal=None, desc_principal=None, cnae_secundario=None, desc_secundario=None)
 
+def _get_history(session_id: bytes, limit: int = 10) -> List[Tuple[str, str]]:
+    with app.state.mem_pool.acquire() as mc:
+        rows = mc.execute(
+            "SELECT role, content FROM chat_history WHERE session_id = ? ORDER BY ts DESC LIMIT ?",
+            (session_id, limit),
+        ).fetchall()
+    return list(reversed(rows))
 
-def busca_contato(cnpj: str) -> ContatoRow:
-    row = con.execute(
-        """
-        SELECT
-          CASE WHEN ddd1 IS NOT NULL AND telefone1 IS NOT NULL THEN ddd1 || telefone1 ELSE NULL END AS telefone,
-          CASE WHEN ddd_fax IS NOT NULL AND fax IS NOT NULL THEN ddd_fax || fax ELSE NULL END AS fax,
-          email
-        FROM estabelecimentos
-        WHERE cnpj_basico = ?
-        LIMIT 1
-        """,
-        [cnpj],
-    ).fetchone()
-    return ContatoRow(telefone=row[0], fax=row[1], email=row[2]) if row else ContatoRow(telefone=None, fax=None, email=None)
 
+def _get_last_conv_by_user(user_name: str, limit: int = 6) -> List[Tuple[str, str]]:
+    with app.state.mem_pool.acquire() as mc:
+        rows = mc.execute(
+            "SELECT role, content FROM chat_history WHERE user_name = ? ORDER BY ts DESC LIMIT ?",
+            (user_name, limit),
+        ).fetchall()
+    return list(reversed(rows))
 
-# ─── Memória Utilitários -------------------------------------------------------
 
-def _add_msg(session_id: str, user_name: str | None, role: str, content: str) -> None:
-    mem_con.execute(
-        "INSERT INTO chat_history VALUES (?,?,?,?,?)",
-        (session_id, user_name, time.time(), role, content),
-    )
-    mem_con.commit()
+async def _add_long_term(content: str, metadata: str = "{}") -> None:
+    await app.state.write_q.put((_LTM_INSERT_SQL, (content, metadata)))
 
 
-def _get_history(session_id: str, limit: int = 10) -> List[Tuple[str, str]]:
-    rows = mem_con.execute(
-        "SELECT role, content FROM chat_history WHERE session_id = ? ORDER BY ts DESC LIMIT ?",
-        (session_id, limit),
-    ).fetchall()
-    return list(reversed(rows))
+# bm25() com pesos por coluna: content conta 10× mais que metadata
+_LTM_SQL = (
+    "SELECT content FROM long_term_memory WHERE long_term_memory MATCH ? "
+    "ORDER BY bm25(long_term_memory, 1.0, 0.1) LIMIT ?"
+)
 
 
-def _get_last_conv_by_user(user_name: str, limit: int = 6) -> List[Tuple[str, str]]:
-    rows = mem_con.execute(
-        "SELECT role, content FROM chat_history WHERE user_name = ? ORDER BY ts DESC LIMIT ?",
-        (user_name, limit),
-    ).fetchall()
-    return list(reversed(rows))
+# Perguntas curtas (< LTM_MIN_TOKENS termos) ou só de saudação não geram
+# acertos úteis na memória longa: nem chegam ao MATCH.
+LTM_MIN_TOKENS = 3
+_SAUDACOES = frozenset({
+    "oi", "olá", "ola", "bom", "boa", "dia", "tarde", "noite",
+    "e", "aí", "ai", "tudo", "bem", "obrigado", "obrigada", "valeu", "tchau",
+})
 
 
-def _add_long_term(content: str, metadata: str = "{}") -> None:
-    mem_con.execute(
-        "INSERT INTO long_term_memory (content, metadata) VALUES (?, ?)",
-        (content, metadata),
-    )
-    mem_con.commit()
+# Pontuação (inclusive aspas) vira espaço antes de montar a consulta FTS5
+_SAFE_Q_RE = re.compile(r"[^\w\s]+")
 
 
 def _search_long_term(query: str, k: int = 3) -> List[str]:
-    if not query.strip():
+    tokens = _SAFE_Q_RE.sub(" ", query).split()
+    if len(tokens) < LTM_MIN_TOKENS:
         return []
-    safe_q = re.sub(r"[^\w\s]", " ", query)
+    if all(tok.lower() in _SAUDACOES for tok in tokens):
+        return []
+    # Cada termo vira uma string FTS5 entre aspas: operadores do usuário
+    # (AND, OR, NEAR, *) não são interpretados pelo MATCH.
+    safe_q = " ".join(f'"{tok}"' for tok in tokens)
     try:
-        sql = f"SELECT content FROM long_term_memory WHERE long_term_memory MATCH ? LIMIT {k}"
-        rows = mem_con.execute(sql, (safe_q,)).fetchall()
+        with app.state.mem_pool.acquire() as mc:
+            rows = mc.execute(_LTM_SQL, (safe_q, k)).fetchall()
         return [r[0] for r in rows]
     except sqlite3.OperationalError:
         return []
@@ -379,33 +585,132 @@ busca_agent = Agent(
         "{\"name\": \"<nome_da_função>\", \"arguments\": { /* argumentos */ }}\n"
         "funções:\n"
         "- busca_empresa(nome: str)\n"
-        "- busca_endereco(cnpj: str)\n"
-        "- busca_simples(cnpj: str)\n"
-        "- lista_socios(cnpj: str)\n"
-        "- busca_natureza(cnpj: str)\n"
-        "- busca_cnaes(cnpj: str)\n"
-        "- busca_contato(cnpj: str)\n"
+        "- busca_empresa_completa(cnpj: str)  → endereco, simples, socios, natureza, cnaes, contato\n"
         "- final_result(cnpj?: str, razao_social?: str, explicacao?: str, "
         "             simples?: List[SimplesRow], socios?: List[SocioRow], "
         "             natureza?: NaturezaRow, cnaes?: CnaeRow, contato?: ContatoRow, endereco?: EmpresaEnderecoRow) \n\n"
         "Regras:\n"
-        "1. Use as funções de busca quantas vezes precisar.\n"
+        "1. Use busca_empresa para obter o CNPJ; se precisar de outros dados, chame busca_empresa_completa(cnpj) uma única vez.\n"
         "2. Quando terminar, chame **somente** `final_result` com todos os campos relevantes."
     ),
     tools=[
         busca_empresa,
-        busca_endereco,
-        busca_simples,
-        lista_socios,
-        busca_natureza,
-        busca_cnaes,
-        busca_contato,
+        busca_empresa_completa,
     ],
 )
 
+# ─── Montagem da resposta ------------------------------------------------------
+
+async def _finaliza_turno(
+    session_id: bytes, user_name: str | None, question: str, data: Result
+) -> Dict[str, Any]:
+    """Persiste o turno nas memórias e devolve o resultado do agente em JSON."""
+    # Se não retornou cnpj, grava erro
+    if not data.cnpj:
+        answer_text = "Empresa não encontrada"
+    else:
+        answer_text = f"CNPJ: {data.cnpj}, Razão Social: {data.razao_social}"
+
+    # Memória curta (enfileirada; gravada em lote pelo `_writer_loop`)
+    await _add_msg(session_id, user_name, "user", question)
+    await _add_msg(session_id, user_name, "assistant", answer_text)
+
+    # Memória longa (só se achou cnpj)
+    if data.cnpj:
+        await _add_long_term(answer_text, metadata=f"{{'user':'{user_name or ''}'}}")
+
+    # Monta resposta final
+    agent_result: Dict[str, Any] = {
+        "cnpj": data.cnpj,
+        "razao_social": data.razao_social,
+        "explicacao": data.explicacao,
+    }
+    if data.simples is not None:
+        agent_result["simples"] = _SIMPLES_TA.dump_python(data.simples, mode="json")
+    if data.socios is not None:
+        agent_result["socios"] = _SOCIOS_TA.dump_python(data.socios, mode="json")
+    if data.natureza is not None:
+        agent_result["natureza"] = data.natureza.model_dump(mode="json")
+    if data.cnaes is not None:
+        agent_result["cnaes"] = data.cnaes.model_dump(mode="json")
+    if data.contato is not None:
+        agent_result["contato"] = data.contato.model_dump(mode="json")
+
+    agent_result["session_id"] = session_id.hex()
+    return agent_result
+
+
+async def _registra_falha(
+    session_id: bytes, user_name: str | None, question: str, motivo: str
+) -> None:
+    """Grava na memória curta um turno que terminou sem resultado do agente."""
+    await _add_msg(session_id, user_name, "user", question)
+    await _add_msg(session_id, user_name, "assistant", motivo)
+
+
+def _monta_resposta(
+    session_id: bytes,
+    greeting_block: Dict[str, Any] | None,
+    agent_result: Dict[str, Any] | None,
+) -> Dict[str, Any]:
+    response: Dict[str, Any] = {}
+    if greeting_block:
+        response.update(greeting_block)
+    if agent_result:
+        response.update(agent_result)
+    if not response:
+        response = {
+            "erro": "Nada para processar — envie uma pergunta.",
+            "session_id": session_id.hex(),
+        }
+    return response
+
+
 # ─── FastAPI -------------------------------------------------------------------
 
-app = FastAPI(title="Chat Empresas CNPJ — v5")
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    con = _abre_duckdb(DB_FILE)
+    app.state.con = con
+    app.state.pool = CursorPool(con.cursor() for _ in range(POOL_SIZE))
+    leitores = [_abre_conexao_memoria(MEM_FILE) for _ in range(MEM_POOL_SIZE)]
+    _migra_memoria(leitores[0])
+    app.state.mem_pool = CursorPool(leitores)
+    # Conexão exclusiva do writer (sem DDL): leituras nunca dividem transação com ele
+    writer_con = _abre_conexao_memoria(MEM_FILE)
+    app.state.write_q = asyncio.Queue()
+    writer = asyncio.create_task(_writer_loop(app.state.write_q, writer_con))
+    try:
+        yield
+    finally:
+        # Não perde turnos ainda na fila, mas não trava o shutdown
+        try:
+            await asyncio.wait_for(app.state.write_q.join(), WRITER_SHUTDOWN_TIMEOUT)
+        except TimeoutError:
+            logger.error(
+                "Fila de escrita não esvaziou em %.1f s; %d escrita(s) ainda na fila",
+                WRITER_SHUTDOWN_TIMEOUT, app.state.write_q.qsize(),
+            )
+        writer.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await writer
+        writer_con.close()
+        app.state.mem_pool.close()
+        app.state.pool.close()
+        con.close()
+        _cnpj_by_nome.cache_clear()
+        busca_empresa_completa.cache_clear()
+
+
+app = FastAPI(title="Chat Empresas CNPJ — v5", lifespan=lifespan)
+
+
+def _session_bytes(x_session_id: str | None) -> bytes:
+    """X-Session-ID (hex ou UUID com hífens) em 16 bytes; ausente ou inválido → nova sessão."""
+    if x_session_id:
+        with contextlib.suppress(ValueError):
+            return uuid.UUID(x_session_id).bytes
+    return uuid.uuid4().bytes
 
 
 class Pergunta(BaseModel):
@@ -417,23 +722,24 @@ class Pergunta(BaseModel):
 async def ask(
     payload: Pergunta,
     x_session_id: str | None = Header(default=None, alias="X-Session-ID"),
+    accept: str | None = Header(default=None),
 ):
-    session_id = x_session_id or str(uuid.uuid4())
+    session_id = _session_bytes(x_session_id)
     question = payload.q.strip()
     user_name = (payload.user or "").strip() or None
 
-    # 1. Memória curta
-    short_mem = _get_history(session_id)
+    # 1-2. Memória curta e longa: leituras SQLite fora do event loop
+    short_mem, long_hits = await asyncio.gather(
+        asyncio.to_thread(_get_history, session_id),
+        asyncio.to_thread(_search_long_term, question),
+    )
     short_ctx = "\n".join([f"{r.upper()}: {c}" for r, c in short_mem])
-
-    # 2. Memória longa
-    long_hits = _search_long_term(question)
     long_ctx = "\n".join(long_hits)
 
     # 3. Saudação + última conversa
     greeting_block: Dict[str, Any] | None = None
     if user_name and not short_mem:
-        prev = _get_last_conv_by_user(user_name)
+        prev = await asyncio.to_thread(_get_last_conv_by_user, user_name)
         if prev:
             greeting_block = {
                 "greeting": f"Bem-vindo(a) de volta, {user_name}!",
@@ -452,54 +758,50 @@ async def ask(
     mensagem_usuario = "\n\n".join(partes)
     print(f"Mensagem do usuário:\n{mensagem_usuario}\n")
 
-    # 5. Chama o agente (somente se houver pergunta)
+    # 5. Streaming NDJSON: uma linha {"partial": ...} por resultado parcial do
+    #    agente e, por fim, a mesma resposta do modo JSON.
+    if question and "application/x-ndjson" in (accept or ""):
+        async def _ndjson() -> AsyncIterator[str]:
+            try:
+                async with busca_agent.run_stream(mensagem_usuario) as stream:
+                    async for parcial in stream.stream(debounce_by=0.1):
+                        linha = {"partial": parcial.model_dump(mode="json", exclude_none=True)}
+                        yield json.dumps(linha, ensure_ascii=False) + "\n"
+                    data = await stream.get_output()
+            except Exception:
+                # O status 200 já foi enviado: o erro vai como última linha
+                logger.exception("Falha no agente durante o streaming")
+                await _registra_falha(session_id, user_name, question, "Erro ao processar a pergunta")
+                erro = {"erro": "Erro ao processar a pergunta.", "session_id": session_id.hex()}
+                yield json.dumps(erro, ensure_ascii=False) + "\n"
+                return
+            except BaseException:
+                # Cliente desconectou (cancelamento/GeneratorExit): o turno é gravado mesmo assim
+                await asyncio.shield(
+                    _registra_falha(session_id, user_name, question, "Resposta interrompida")
+                )
+                raise
+            agent_result = await asyncio.shield(
+                _finaliza_turno(session_id, user_name, question, data)
+            )
+            resposta = _monta_resposta(session_id, greeting_block, agent_result)
+            yield json.dumps(resposta, ensure_ascii=False) + "\n"
+
+        return StreamingResponse(_ndjson(), media_type="application/x-ndjson")
+
+    # 6. Chama o agente (somente se houver pergunta)
     agent_result: Dict[str, Any] | None = None
     if question:
-        res = await busca_agent.run(mensagem_usuario.upper())
-
-        # Se não retornou cnpj, grava erro
-        if not res.data.cnpj:
-            answer_text = "Empresa não encontrada"
-        else:
-            answer_text = f"CNPJ: {res.data.cnpj}, Razão Social: {res.data.razao_social}"
+        res = await busca_agent.run(mensagem_usuario)
+        agent_result = await _finaliza_turno(session_id, user_name, question, res.data)
 
-        # Persiste na memória curta
-        _add_msg(session_id, user_name, "user", question)
-        _add_msg(session_id, user_name, "assistant", answer_text)
+    # 7. Retorna saudação + resultado
+    return _monta_resposta(session_id, greeting_block, agent_result)
 
-        # Persiste na memória longa (só se achou cnpj)
-        if res.data.cnpj:
-            _add_long_term(answer_text, metadata=f"{{'user':'{user_name or ''}'}}")
 
-        # Monta resposta final
-        agent_result = {
-            "cnpj": res.data.cnpj,
-            "razao_social": res.data.razao_social,
-            "explicacao": res.data.explicacao,
-        }
-        if res.data.simples is not None:
-            agent_result["simples"] = [row.dict() for row in res.data.simples]
-        if res.data.socios is not None:
-            agent_result["socios"] = [row.dict() for row in res.data.socios]
-        if res.data.natureza is not None:
-            agent_result["natureza"] = res.data.natureza.dict()
-        if res.data.cnaes is not None:
-            agent_result["cnaes"] = res.data.cnaes.dict()
-        if res.data.contato is not None:
-            agent_result["contato"] = res.data.contato.dict()
-
-        agent_result["session_id"] = session_id
-
-    # 6. Retorna saudação + resultado
-    response: Dict[str, Any] = {}
-    if greeting_block:
-        response.update(greeting_block)
-    if agent_result:
-        response.update(agent_result)
-    if not response:
-        response = {
-            "erro": "Nada para processar — envie uma pergunta.",
-            "session_id": session_id,
-        }
-
-    return response
+@app.post("/cache/clear")
+async def cache_clear():
+    """Esvazia os caches LRU das consultas ao DuckDB (ex.: após recarregar o banco)."""
+    _cnpj_by_nome.cache_clear()
+    busca_empresa_completa.cache_clear()
+    return {"ok": True}
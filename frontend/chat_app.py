@@ -4,12 +4,16 @@
 # • Envia o nome do usuário; se ele já tiver histórico, o back‑end responde     #
 #   com `greeting` e `previous` logo na primeira requisição.                    #
 # • Mostra resposta JSON e latência.                                            #
+# • Pede a resposta em NDJSON e exibe os resultados parciais do agente.         #
 # ------------------------------------------------------------------------------
 
+import json
 import time
 import streamlit as st
 import requests
-from typing import Dict, Any, List, Tuple
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Callable, Dict, Any, List, Tuple
 
 # ────────────────────────────── Sessão ‑ inicialização ─────────────────────────
 DEFAULT_API_URL = "http://localhost:8000/ask"
@@ -24,6 +28,18 @@ for k, v in state_defaults.items():
     if k not in st.session_state:
         st.session_state[k] = v
 
+# Sessão HTTP persistente (keep-alive) reaproveitada entre reruns do Streamlit
+if "_http" not in st.session_state:
+    http = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=4,
+        max_retries=Retry(total=2, backoff_factor=0.2),
+    )
+    http.mount("http://", adapter)
+    http.mount("https://", adapter)
+    st.session_state._http = http
+
 # ───────────────────────────── Sidebar de configuração ─────────────────────────
 st.sidebar.title("🔧 Configurações")
 st.session_state.api_url = st.sidebar.text_input(
@@ -47,7 +63,7 @@ def _post(payload: Dict[str, Any]) -> Dict[str, Any]:
     if st.session_state.session_id:
         headers["X-Session-ID"] = st.session_state.session_id
 
-    resp = requests.post(
+    resp = st.session_state._http.post(
         st.session_state.api_url,
         json=payload,
         headers=headers,
@@ -57,6 +73,34 @@ def _post(payload: Dict[str, Any]) -> Dict[str, Any]:
     return resp.json()
 
 
+def _post_stream(
+    payload: Dict[str, Any], on_partial: Callable[[Dict[str, Any]], None]
+) -> Dict[str, Any]:
+    """POST em modo NDJSON: repassa cada `partial` e devolve a linha final."""
+    headers = {"Accept": "application/x-ndjson"}
+    if st.session_state.session_id:
+        headers["X-Session-ID"] = st.session_state.session_id
+
+    final: Dict[str, Any] = {}
+    with st.session_state._http.post(
+        st.session_state.api_url,
+        json=payload,
+        headers=headers,
+        timeout=60,
+        stream=True,
+    ) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if not line:
+                continue
+            msg = json.loads(line)
+            if "partial" in msg:
+                on_partial(msg["partial"])
+            else:
+                final = msg
+    return final
+
+
 def _handle_backend_resp(resp_json: Dict[str, Any]):
     """Interpreta campos especiais (greeting, previous, session_id)."""
     # session_id gerenciado
@@ -100,13 +144,15 @@ if user_msg:
         if st.session_state.user_name:
             payload["user"] = st.session_state.user_name
 
-        # Medir latência
+        # Medir latência; resultados parciais aparecem enquanto o agente responde
+        parcial = st.empty()
         t0 = time.perf_counter()
         try:
-            resp_json = _post(payload)
+            resp_json = _post_stream(payload, parcial.json)
         except Exception as e:
             resp_json = {"erro": str(e)}
         elapsed_ms = (time.perf_counter() - t0) * 1000
+        parcial.empty()
         elapsed_s = elapsed_ms / 1000
 
         # Trata resposta
@@ -0,0 +1,310 @@
+# tests/test_app.py
+#
+# Testes do back-end sem servidor nem LLM: o app sobe via TestClient (lifespan)
+# contra um DuckDB e um memory.sqlite temporários, e o agente é trocado por
+# um FunctionModel determinístico.
+# Rode: pytest -q tests/test_app.py
+
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import duckdb
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from pydantic_ai.messages import ModelResponse, ToolCallPart, UserPromptPart
+from pydantic_ai.models.function import AgentInfo, DeltaToolCall, FunctionModel
+
+os.environ.setdefault("GROQ_API_KEY", "test")  # o Agent valida a chave no import
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+import main as m  # noqa: E402
+
+NDJSON = {"Accept": "application/x-ndjson"}
+SCORAS = {"cnpj": "00000001", "razao_social": "SCORAS TECNOLOGIA LTDA"}
+
+
+# Esquema mínimo do cnpj.duckdb; 00000001 tem filial (inserida antes) e matriz
+CNPJ_FIXTURE = """
+CREATE TABLE empresas (cnpj_basico VARCHAR, razao_social VARCHAR, natureza_juridica VARCHAR);
+INSERT INTO empresas VALUES
+  ('00000001', 'SCORAS TECNOLOGIA LTDA', '2062'),
+  ('00000002', 'PADARIA SÃO JOÃO', '2135');
+CREATE TABLE estabelecimentos (
+  cnpj_basico VARCHAR, cnpj_ordem VARCHAR, cnpj_dv VARCHAR, identificador_matriz_filial VARCHAR,
+  nome_fantasia VARCHAR, cnae_fiscal_principal VARCHAR, cnae_fiscal_secundaria VARCHAR,
+  tipo_logradouro VARCHAR, logradouro VARCHAR, numero VARCHAR, complemento VARCHAR,
+  bairro VARCHAR, municipio VARCHAR, uf VARCHAR,
+  ddd1 VARCHAR, telefone1 VARCHAR, ddd_fax VARCHAR, fax VARCHAR, email VARCHAR
+);
+INSERT INTO estabelecimentos VALUES
+  ('00000001', '0002', '72', '2', 'SCORAS FILIAL', '6202300', NULL, 'RUA', 'B', '2', '', 'CENTRO', '7107', 'RJ',
+   NULL, NULL, NULL, NULL, NULL),
+  ('00000001', '0001', '91', '1', 'SCORAS', '6201501', '6202300', 'RUA', 'A', '1', 'SALA 1', 'CENTRO', '7107', 'SP',
+   '11', '99999999', NULL, NULL, 'contato@scoras.com.br');
+CREATE TABLE municipios (codigo VARCHAR, descricao VARCHAR);
+INSERT INTO municipios VALUES ('7107', 'SAO PAULO');
+CREATE TABLE naturezas (codigo VARCHAR, descricao VARCHAR);
+INSERT INTO naturezas VALUES ('2062', 'Sociedade Empresária Limitada');
+CREATE TABLE cnaes (codigo VARCHAR, descricao VARCHAR);
+INSERT INTO cnaes VALUES ('6201501', 'Desenvolvimento de programas de computador sob encomenda'),
+                         ('6202300', 'Desenvolvimento e licenciamento de programas customizáveis');
+CREATE TABLE simples (
+  cnpj_basico VARCHAR, opcao_simples VARCHAR, data_opcao_simples DATE, data_exclusao_simples DATE,
+  opcao_mei VARCHAR, data_opcao_mei DATE, data_exclusao_mei DATE
+);
+INSERT INTO simples VALUES
+  ('00000001', 'N', '2018-01-01', '2019-12-31', 'N', NULL, NULL),
+  ('00000001', 'S', '2020-01-01', NULL, 'N', NULL, NULL);
+CREATE TABLE socios (
+  cnpj_basico VARCHAR, identificador_socio VARCHAR, nome_socio_razao_social VARCHAR,
+  cpf_cnpj_socio VARCHAR, qualificacao_socio VARCHAR, data_entrada_sociedade DATE, pais VARCHAR,
+  nome_representante VARCHAR, qualificacao_representante VARCHAR, faixa_etaria VARCHAR
+);
+INSERT INTO socios VALUES
+  ('00000001', '2', 'FULANO', '***123***', '49', '2019-01-01', NULL, NULL, NULL, '4'),
+  ('00000001', '2', 'CICRANO', '***456***', '49', '2021-06-01', NULL, NULL, NULL, '3');
+"""
+
+
+def _responde(messages, info: AgentInfo) -> ModelResponse:
+    return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, SCORAS)])
+
+
+def _eco(messages, info: AgentInfo) -> ModelResponse:
+    """Devolve o prompt recebido em `explicacao` (para inspecionar o contexto)."""
+    prompt = next(
+        p.content for p in messages[-1].parts if isinstance(p, UserPromptPart)
+    )
+    return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, {"explicacao": prompt})])
+
+
+async def _responde_stream(messages, info: AgentInfo):
+    nome = info.output_tools[0].name
+    yield {0: DeltaToolCall(name=nome, json_args='{"cnpj": "00000001", ')}
+    yield {0: DeltaToolCall(json_args='"razao_social": "SCORAS TECNOLOGIA LTDA"}')}
+
+
+async def _falha_stream(messages, info: AgentInfo):
+    raise RuntimeError("modelo fora do ar")
+    yield ""  # pragma: no cover — torna a função um gerador assíncrono
+
+
+def _flush(client: TestClient) -> None:
+    """Espera o writer gravar tudo que está na fila."""
+    client.portal.call(m.app.state.write_q.join)
+
+
+@pytest.fixture
+def mem_file(tmp_path, monkeypatch) -> Path:
+    cnpj_db = tmp_path / "cnpj.duckdb"
+    con = duckdb.connect(str(cnpj_db))
+    con.execute(CNPJ_FIXTURE)
+    con.close()
+
+    mem = tmp_path / "memory.sqlite"
+    monkeypatch.setattr(m, "DB_FILE", str(cnpj_db))
+    monkeypatch.setattr(m, "MEM_FILE", str(mem))
+    return mem
+
+
+@pytest.fixture
+def client(mem_file):
+    model = FunctionModel(_responde, stream_function=_responde_stream)
+    with TestClient(m.app) as c, m.busca_agent.override(model=model):
+        yield c
+
+
+# ─── Migração do memory.sqlite ------------------------------------------------
+
+def test_migra_memoria_legada(mem_file):
+    sid = "3f1c2b8e-4a5d-4e6f-8a7b-9c0d1e2f3a4b"
+    legado = sqlite3.connect(mem_file)
+    legado.execute("CREATE TABLE chat_history (session_id TEXT, ts REAL, role TEXT, content TEXT)")
+    legado.execute("INSERT INTO chat_history VALUES (?, 1.0, 'user', 'oi')", (sid,))
+    legado.execute("CREATE VIRTUAL TABLE long_term_memory USING fts5(content, metadata)")
+    legado.execute(
+        "INSERT INTO long_term_memory VALUES ('CNPJ: 00000002, Razão Social: PADARIA SÃO JOÃO', '{}')"
+    )
+    legado.commit()
+    legado.close()
+
+    with TestClient(m.app):
+        assert m._get_history(uuid.UUID(sid).bytes) == [("user", "oi")]
+        # Conteúdo copiado para long_term_docs; o FTS5 ignora acentos
+        assert m._search_long_term("padaria sao joao") == [
+            "CNPJ: 00000002, Razão Social: PADARIA SÃO JOÃO"
+        ]
+
+    con = sqlite3.connect(mem_file)
+    cols = [r[1] for r in con.execute("PRAGMA table_info(chat_history)")]
+    assert "user_name" in cols
+    assert con.execute("SELECT DISTINCT typeof(session_id) FROM chat_history").fetchall() == [("blob",)]
+    ltm_sql = con.execute("SELECT sql FROM sqlite_master WHERE name = 'long_term_memory'").fetchone()[0]
+    assert "content='long_term_docs'" in ltm_sql
+    assert con.execute("SELECT count(*) FROM long_term_docs").fetchone()[0] == 1
+    con.close()
+
+
+# ─── /ask + writer -------------------------------------------------------------
+
+def test_ask_grava_turno_e_le_historico(client):
+    r = client.post("/ask", json={"q": "Qual o CNPJ da SCORAS TECNOLOGIA?", "user": "Ana"})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["cnpj"] == "00000001"
+    assert body["greeting"] == "Olá, Ana! Como posso ajudar hoje?"
+    sid = body["session_id"]
+    assert len(sid) == 32
+
+    _flush(client)
+    assert m._get_history(bytes.fromhex(sid)) == [
+        ("user", "Qual o CNPJ da SCORAS TECNOLOGIA?"),
+        ("assistant", "CNPJ: 00000001, Razão Social: SCORAS TECNOLOGIA LTDA"),
+    ]
+    assert m._search_long_term("razão social scoras") == [
+        "CNPJ: 00000001, Razão Social: SCORAS TECNOLOGIA LTDA"
+    ]
+
+    # Nova sessão do mesmo usuário: saudação com a última conversa
+    r = client.post("/ask", json={"q": "", "user": "Ana"})
+    assert r.json()["greeting"] == "Bem-vindo(a) de volta, Ana!"
+    assert [p["role"] for p in r.json()["previous"]] == ["user", "assistant"]
+
+
+def test_ask_concorrente_isola_historicos(client):
+    sessoes = [uuid.uuid4().bytes for _ in range(8)]
+    for i, sid in enumerate(sessoes):
+        client.portal.call(m._add_msg, sid, None, "user", f"marcador-sessao-{i}")
+    _flush(client)
+
+    async def rodada():
+        transport = httpx.ASGITransport(app=m.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as ac:
+            reqs = [
+                ac.post("/ask", json={"q": "qual o cnpj?"}, headers={"X-Session-ID": sid.hex()})
+                for _ in range(6)
+                for sid in sessoes
+            ]
+            return await asyncio.gather(*reqs)
+
+    with m.busca_agent.override(model=FunctionModel(_eco)):
+        respostas = client.portal.call(rodada)
+
+    for r in respostas:
+        assert r.status_code == 200
+        i = sessoes.index(bytes.fromhex(r.json()["session_id"]))
+        explicacao = r.json()["explicacao"]
+        assert f"marcador-sessao-{i}" in explicacao
+        assert explicacao.count("marcador-sessao-") == 1
+
+
+def test_leituras_paralelas_da_memoria(client):
+    sessoes = [uuid.uuid4().bytes for _ in range(8)]
+    for i, sid in enumerate(sessoes):
+        for j in range(5):
+            client.portal.call(m._add_msg, sid, f"u{i}", "user", f"s{i}-m{j}")
+    _flush(client)
+
+    def le(i: int) -> None:
+        for _ in range(1000):
+            hist = m._get_history(sessoes[i])
+            assert hist == [("user", f"s{i}-m{j}") for j in range(5)]
+
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        list(ex.map(le, range(8)))
+
+
+def test_ask_ndjson(client):
+    r = client.post("/ask", json={"q": "cnpj da scoras?"}, headers=NDJSON)
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    linhas = [json.loads(linha) for linha in r.text.splitlines()]
+    assert all("partial" in linha for linha in linhas[:-1])
+    assert linhas[-1]["cnpj"] == "00000001"
+    assert len(linhas[-1]["session_id"]) == 32
+
+
+def test_ask_ndjson_erro_do_agente(client):
+    with m.busca_agent.override(model=FunctionModel(stream_function=_falha_stream)):
+        r = client.post("/ask", json={"q": "cnpj da scoras?"}, headers=NDJSON)
+    assert r.status_code == 200
+    ultima = json.loads(r.text.splitlines()[-1])
+    assert "erro" in ultima
+
+    _flush(client)
+    hist = m._get_history(bytes.fromhex(ultima["session_id"]))
+    assert hist == [("user", "cnpj da scoras?"), ("assistant", "Erro ao processar a pergunta")]
+
+
+# ─── Memória longa -------------------------------------------------------------
+
+def test_search_long_term_gate_e_aspas(client):
+    client.portal.call(m._add_long_term, "CNPJ: 00000002, Razão Social: PADARIA SÃO JOÃO")
+    _flush(client)
+
+    # Perguntas curtas ou só saudação não consultam o FTS5
+    assert m._search_long_term("padaria joão") == []
+    assert m._search_long_term("Olá, bom dia!") == []
+    assert m._search_long_term("?? !! ...") == []
+
+    # Pontuação e operadores FTS5 do usuário viram termos literais
+    esperado = ["CNPJ: 00000002, Razão Social: PADARIA SÃO JOÃO"]
+    assert m._search_long_term('padaria "são" joão?') == esperado
+    assert m._search_long_term("padaria-sao joao") == esperado
+    assert m._search_long_term("padaria OR joão NEAR x*") == []
+
+
+def test_session_bytes():
+    sid = uuid.uuid4()
+    assert m._session_bytes(sid.hex) == sid.bytes
+    assert m._session_bytes(str(sid)) == sid.bytes
+    assert len(m._session_bytes("não-é-uuid")) == 16
+    assert m._session_bytes("não-é-uuid") != m._session_bytes("não-é-uuid")
+    assert len(m._session_bytes(None)) == 16
+
+
+# ─── DuckDB ----------------------------------------------------------------------
+
+def test_busca_empresa_sem_fts_e_cache_clear(client):
+    # Sem índice FTS: LIKE sobre strip_accents(upper(razao_social))
+    assert m.busca_empresa("Padaria São João").cnpj == "00000002"
+    assert m.busca_empresa("padaria sao joao").cnpj == "00000002"
+    assert m.busca_empresa("inexistente").cnpj is None
+    assert m._cnpj_by_nome.cache_info().currsize > 0
+
+    assert client.post("/cache/clear").json() == {"ok": True}
+    assert m._cnpj_by_nome.cache_info().currsize == 0
+
+
+def test_busca_empresa_completa(client):
+    dados = m.busca_empresa_completa("00000001")
+
+    # Matriz tem prioridade sobre a filial (ORDER BY identificador_matriz_filial)
+    assert dados.endereco.cnpj_mascarado == "00.000.001/0001-91"
+    assert dados.endereco.nome_fantasia == "SCORAS"
+    assert "Cidade: SAO PAULO Estado: SP" in dados.endereco.endereco
+    assert dados.cnaes.cnae_principal == "6201501"
+    assert dados.cnaes.desc_principal.startswith("Desenvolvimento de programas")
+    assert dados.contato.telefone == "1199999999"
+    assert dados.contato.email == "contato@scoras.com.br"
+    assert dados.natureza.descricao == "Sociedade Empresária Limitada"
+
+    # Listas em ordem decrescente de data
+    assert [s.nome_socio_razao_social for s in dados.socios] == ["CICRANO", "FULANO"]
+    assert dados.socios[0].data_entrada_sociedade == "2021-06-01"
+    assert [s.data_opcao_simples for s in dados.simples] == ["2020-01-01", "2018-01-01"]
+
+    # CNPJ inexistente: tudo vazio, listas []
+    assert m.busca_empresa_completa("99999999") == m.DadosEmpresa()
+
+    # Chamada repetida vem do LRU
+    hits = m.busca_empresa_completa.cache_info().hits
+    assert m.busca_empresa_completa("00000001") is dados
+    assert m.busca_empresa_completa.cache_info().hits == hits + 1